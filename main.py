@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import logging
+import sys
 import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from dataclasses import dataclass
+from functools import lru_cache
 from decimal import Decimal
 from datetime import datetime, date
-from typing import Dict, List, Optional, Union, Any, Tuple
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Union, Any, Tuple
 from enum import Enum
-import copy
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -122,6 +127,20 @@ HL7_TABLES = {
     }
 }
 
+ROUTE_FIELD_CACHE = {
+    code: f"{code}^{name}^HL70162" for code, name in HL7_TABLES["route"].items()
+}
+MEDICATION_FORM_CACHE = HL7_TABLES["medication_form"]
+
+PID_TEMPLATE = "PID|1||{patient_id}^^{facility}^MR||{name}||{dob}|{gender}" + "|" * 22
+OBX_WEIGHT_TEMPLATE = "OBX|{set_id}|NM|3141-9^Body weight Measured^LN||{value}|kg|||||F|||{ts}||"
+OBX_HEIGHT_TEMPLATE = "OBX|{set_id}|NM|8302-2^Body height^LN||{value}|cm|||||F|||{ts}||"
+PV1_TEMPLATE = "PV1|1|{patient_class}" + "|" * 48
+RXR_TEMPLATE = "RXR|{route}|{site}||||"
+DG1_TEMPLATE = "DG1|{set_id}|I10|{code}^{description}^I10||{ts}|W" + "|" * 15
+AL1_TEMPLATE = "AL1|{set_id}|DA|{allergy}|||"
+NTE_TEMPLATE = "NTE|{set_id}|{source}|{comment}"
+
 class HL7EncodingCharacters:
     def __init__(self):
         self.field_separator = HL7_SEPARATORS['field']
@@ -129,11 +148,50 @@ class HL7EncodingCharacters:
         self.repetition_separator = HL7_SEPARATORS['repetition']
         self.escape_character = HL7_SEPARATORS['escape']
         self.subcomponent_separator = HL7_SEPARATORS['subcomponent']
-    
+
+        esc = self.escape_character
+        self._escape_table = {
+            self.field_separator: f"{esc}F{esc}",
+            self.component_separator: f"{esc}S{esc}",
+            self.repetition_separator: f"{esc}R{esc}",
+            esc: f"{esc}E{esc}",
+            self.subcomponent_separator: f"{esc}T{esc}",
+        }
+        self._escape_re = re.compile(
+            "[" + re.escape("".join(self._escape_table)) + "]"
+        )
+        self.escape = self._make_escape()
+
+    def _make_escape(self):
+        table = self._escape_table
+        search = self._escape_re.search
+        sub = self._escape_re.sub
+
+        def repl(match):
+            return table[match.group(0)]
+
+        def escape(value: str) -> str:
+            if not value:
+                return ""
+
+            if search(value) is None:
+                return value
+
+            return sub(repl, value)
+
+        return escape
+
     def __str__(self):
         return f"{self.field_separator}{self.component_separator}{self.repetition_separator}{self.escape_character}{self.subcomponent_separator}"
 
 class MedicationItem:
+    __slots__ = (
+        'medication_code', 'medication_name', 'form', 'strength', 'quantity',
+        'unit', 'dosage_instruction', 'route', 'duration_days', 'refills',
+        'special_instructions', 'substitution_allowed', 'frequency',
+        'start_datetime', 'end_datetime',
+    )
+
     def __init__(
         self,
         medication_code: str,
@@ -169,6 +227,11 @@ class MedicationItem:
         self.end_datetime = end_datetime
 
 class PatientInfo:
+    __slots__ = (
+        'patient_id', 'name', 'date_of_birth', 'gender', 'weight_kg',
+        'height_cm', 'allergies', 'diagnoses',
+    )
+
     def __init__(
         self,
         patient_id: str,
@@ -190,6 +253,8 @@ class PatientInfo:
         self.diagnoses = diagnoses or []
 
 class PrescribingProvider:
+    __slots__ = ('id', 'name', 'qualification', 'specialty', 'contact', 'address')
+
     def __init__(
         self,
         id: str,
@@ -207,6 +272,8 @@ class PrescribingProvider:
         self.address = address
 
 class PharmacyInfo:
+    __slots__ = ('id', 'name', 'address', 'contact')
+
     def __init__(
         self,
         id: str,
@@ -219,7 +286,7 @@ class PharmacyInfo:
         self.address = address
         self.contact = contact
 
-@dataclass
+@dataclass(frozen=True)
 class HL7Config:
     version: str = "2.5"
     message_type: MessageType = MessageType.RDE
@@ -238,40 +305,85 @@ class HL7Config:
     max_field_length: int = 200
     escape_xml_chars: bool = True
 
+@lru_cache(maxsize=8)
+def _msh_template(
+    sending_application: str,
+    sending_facility: str,
+    receiving_application: str,
+    receiving_facility: str,
+    message_type: MessageType,
+    processing_id: str,
+    version: str,
+    country_code: str,
+    charset: str,
+) -> Tuple[str, str, str]:
+    encoding = HL7EncodingCharacters()
+    esc = encoding.escape
+    fields = [""] * 20
+    fields[1] = esc(str(encoding))
+    fields[2] = esc(sending_application)
+    fields[3] = esc(sending_facility)
+    fields[4] = esc(receiving_application)
+    fields[5] = esc(receiving_facility)
+    fields[8] = esc(message_type.value)
+    fields[10] = esc(processing_id)
+    fields[11] = esc(version)
+    fields[14] = "AL"
+    fields[15] = "AL"
+    fields[16] = esc(country_code)
+    fields[17] = esc(charset)
+    return (
+        "MSH|" + "|".join(fields[:6]),
+        "|".join(fields[7:9]),
+        "|".join(fields[10:]),
+    )
+
 class HL7GenerationError(Exception):
     def __init__(self, message: str, segment: Optional[str] = None, field: Optional[str] = None):
         self.segment = segment
         self.field = field
         super().__init__(message)
 
+_EMPTY_FIELDS = [""] * 60
+
 class HL7Segment:
+    __slots__ = ('segment_id', 'encoding', 'fields')
+
+    SEGMENT_WIDTHS = {
+        "MSH": 20,
+        "PID": 30,
+        "PV1": 50,
+        "ORC": 16,
+        "RXE": 30,
+        "RXD": 38,
+        "RXR": 6,
+        "DG1": 21,
+        "AL1": 6,
+        "NTE": 3,
+        "OBX": 16,
+    }
+
     def __init__(self, segment_id: str, encoding: HL7EncodingCharacters):
         self.segment_id = segment_id
         self.encoding = encoding
-        self.fields: List[str] = []
-    
+        self.fields: List[str] = _EMPTY_FIELDS[:self.SEGMENT_WIDTHS.get(segment_id, 0)]
+
     def add_field(self, value: Optional[Any], position: int) -> None:
-        while len(self.fields) < position:
-            self.fields.append("")
-        
-        if value is None:
-            self.fields.append("")
-        else:
-            str_value = self._escape_hl7(str(value))
-            self.fields.append(str_value)
-    
-    def set_field(self, value: Optional[Any], position: int) -> None:
         if position < 1:
             raise ValueError("Position must be >= 1")
-        
+
+        self.pad_to(position)
+        self.fields[position - 1] = (
+            self._escape_hl7(str(value)) if value is not None else ""
+        )
+
+    def set_field(self, value: Optional[Any], position: int) -> None:
+        self.add_field(value, position)
+
+    def pad_to(self, position: int) -> None:
         if len(self.fields) < position:
-            self.add_field(value, position)
-        else:
-            if value is None:
-                self.fields[position - 1] = ""
-            else:
-                self.fields[position - 1] = self._escape_hl7(str(value))
-    
+            self.fields.extend([""] * (position - len(self.fields)))
+
     def add_component(self, value: Optional[Any], field_pos: int, comp_pos: int) -> None:
         if field_pos < 1 or comp_pos < 1:
             raise ValueError("Positions must be >= 1")
@@ -289,22 +401,7 @@ class HL7Segment:
         self.fields[field_pos - 1] = self.encoding.component_separator.join(components)
     
     def _escape_hl7(self, value: str) -> str:
-        if not value:
-            return ""
-        
-        escape_map = {
-            self.encoding.field_separator: f"{self.encoding.escape_character}F{self.encoding.escape_character}",
-            self.encoding.component_separator: f"{self.encoding.escape_character}S{self.encoding.escape_character}",
-            self.encoding.repetition_separator: f"{self.encoding.escape_character}R{self.encoding.escape_character}",
-            self.encoding.escape_character: f"{self.encoding.escape_character}E{self.encoding.escape_character}",
-            self.encoding.subcomponent_separator: f"{self.encoding.escape_character}T{self.encoding.escape_character}",
-        }
-        
-        result = value
-        for char, escape_seq in escape_map.items():
-            result = result.replace(char, escape_seq)
-        
-        return result
+        return self.encoding.escape(value)
     
     def build(self) -> str:
         field_str = self.encoding.field_separator.join(self.fields)
@@ -314,20 +411,42 @@ class HL7Builder:
     def __init__(self, config: HL7Config):
         self.config = config
         self.encoding = HL7EncodingCharacters()
-        self.segments: List[HL7Segment] = []
-        self.message_control_id = config.message_control_id or self._generate_control_id()
-    
+        self.segments: List[str] = []
+        self._segment_counts: Dict[str, int] = defaultdict(int)
+        self._now = datetime.now()
+        self._now_hl7 = self._now.strftime("%Y%m%d%H%M%S")
+        self._is_rde = config.message_type is MessageType.RDE
+        self.message_control_id = config.message_control_id
+
+    def _append(self, segment: HL7Segment) -> None:
+        self._segment_counts[segment.segment_id] += 1
+        self.segments.append(segment.build())
+
+    def _append_raw(self, segment_id: str, text: str) -> None:
+        self._segment_counts[segment_id] += 1
+        self.segments.append(text)
+
     def _generate_control_id(self) -> str:
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")[:-3]
         return f"MSG{timestamp}"
     
+    _DATE_FORMATS = {datetime: "%Y%m%d%H%M%S", date: "%Y%m%d"}
+
     def _format_hl7_date(self, dt: Union[datetime, date]) -> str:
+        fmt = self._DATE_FORMATS.get(type(dt))
+        if fmt is not None:
+            return dt.strftime(fmt)
+
         if isinstance(dt, datetime):
             return dt.strftime("%Y%m%d%H%M%S")
         elif isinstance(dt, date):
             return dt.strftime("%Y%m%d")
         return ""
     
+    @staticmethod
+    def _fmt_decimal(value: Decimal) -> str:
+        return format(value, "f")
+
     def _format_name(self, name: str) -> str:
         parts = name.split()
         if len(parts) >= 2:
@@ -335,116 +454,58 @@ class HL7Builder:
         return name
     
     def add_msh_segment(self) -> None:
-        msh = HL7Segment("MSH", self.encoding)
-        
-        msh.add_field(str(self.encoding), 2)
-        msh.add_field(self.config.sending_application, 3)
-        msh.add_field(self.config.sending_facility, 4)
-        msh.add_field(self.config.receiving_application, 5)
-        msh.add_field(self.config.receiving_facility, 6)
-        msh.add_field(self._format_hl7_date(datetime.now()), 7)
-        msh.add_field("", 8)
-        msh.add_field(self.config.message_type.value, 9)
-        msh.add_field(self.message_control_id, 10)
-        msh.add_field(self.config.processing_id, 11)
-        msh.add_field(self.config.version, 12)
-        msh.add_field("", 13)
-        msh.add_field("", 14)
-        msh.add_field("AL", 15)
-        msh.add_field("AL", 16)
-        msh.add_field(self.config.country_code, 17)
-        msh.add_field(self.config.charset, 18)
-        msh.add_field("", 19)
-        msh.add_field("", 20)
-        
-        self.segments.append(msh)
+        if self.message_control_id is None:
+            self.message_control_id = self._generate_control_id()
+
+        config = self.config
+        head, middle, tail = _msh_template(
+            config.sending_application,
+            config.sending_facility,
+            config.receiving_application,
+            config.receiving_facility,
+            config.message_type,
+            config.processing_id,
+            config.version,
+            config.country_code,
+            config.charset,
+        )
+        self._append_raw("MSH", "|".join((
+            head,
+            self._now_hl7,
+            middle,
+            self.encoding.escape(self.message_control_id),
+            tail,
+        )))
     
     def add_pid_segment(self, patient: PatientInfo) -> None:
-        pid = HL7Segment("PID", self.encoding)
-        
-        pid.add_field("1", 1)
-        pid.add_field("", 2)
-        pid.add_field(f"{patient.patient_id}^^{self.config.sending_facility}^MR", 3)
-        pid.add_field("", 4)
-        pid.add_field(self._format_name(patient.name), 5)
-        pid.add_field("", 6)
-        pid.add_field(self._format_hl7_date(patient.date_of_birth), 7)
-        pid.add_field(patient.gender, 8)
-        pid.add_field("", 9)
-        pid.add_field("", 10)
-        pid.add_field("", 11)
-        pid.add_field("", 12)
-        pid.add_field("", 13)
-        pid.add_field("", 14)
-        pid.add_field("", 15)
-        pid.add_field("", 16)
-        pid.add_field("", 17)
-        pid.add_field("", 18)
-        pid.add_field("", 19)
-        pid.add_field("", 20)
-        pid.add_field("", 21)
-        pid.add_field("", 22)
-        pid.add_field("", 23)
-        pid.add_field("", 24)
-        pid.add_field("", 25)
-        pid.add_field("", 26)
-        pid.add_field("", 27)
-        pid.add_field("", 28)
-        pid.add_field("", 29)
-        pid.add_field("", 30)
-        
-        self.segments.append(pid)
-        
+        esc = self.encoding.escape
+
+        self._append_raw("PID", PID_TEMPLATE.format(
+            patient_id=esc(patient.patient_id),
+            facility=esc(self.config.sending_facility),
+            name=self._format_name(esc(patient.name)),
+            dob=self._format_hl7_date(patient.date_of_birth),
+            gender=esc(patient.gender),
+        ))
+
         if patient.weight_kg:
-            obx = HL7Segment("OBX", self.encoding)
-            obx.add_field(str(len([s for s in self.segments if s.segment_id == "OBX"]) + 1), 1)
-            obx.add_field("NM", 2)
-            obx.add_field("3141-9^Body weight Measured^LN", 3)
-            obx.add_field("", 4)
-            obx.add_field(str(patient.weight_kg), 5)
-            obx.add_field("kg", 6)
-            obx.add_field("", 7)
-            obx.add_field("", 8)
-            obx.add_field("", 9)
-            obx.add_field("", 10)
-            obx.add_field("F", 11)
-            obx.add_field("", 12)
-            obx.add_field("", 13)
-            obx.add_field(self._format_hl7_date(datetime.now()), 14)
-            obx.add_field("", 15)
-            obx.add_field("", 16)
-            self.segments.append(obx)
-        
+            self._append_raw("OBX", OBX_WEIGHT_TEMPLATE.format(
+                set_id=self._segment_counts["OBX"] + 1,
+                value=self._fmt_decimal(patient.weight_kg),
+                ts=self._now_hl7,
+            ))
+
         if patient.height_cm:
-            obx = HL7Segment("OBX", self.encoding)
-            obx.add_field(str(len([s for s in self.segments if s.segment_id == "OBX"]) + 1), 1)
-            obx.add_field("NM", 2)
-            obx.add_field("8302-2^Body height^LN", 3)
-            obx.add_field("", 4)
-            obx.add_field(str(patient.height_cm), 5)
-            obx.add_field("cm", 6)
-            obx.add_field("", 7)
-            obx.add_field("", 8)
-            obx.add_field("", 9)
-            obx.add_field("", 10)
-            obx.add_field("F", 11)
-            obx.add_field("", 12)
-            obx.add_field("", 13)
-            obx.add_field(self._format_hl7_date(datetime.now()), 14)
-            obx.add_field("", 15)
-            obx.add_field("", 16)
-            self.segments.append(obx)
-    
+            self._append_raw("OBX", OBX_HEIGHT_TEMPLATE.format(
+                set_id=self._segment_counts["OBX"] + 1,
+                value=self._fmt_decimal(patient.height_cm),
+                ts=self._now_hl7,
+            ))
+
     def add_pv1_segment(self, patient_class: str = "O") -> None:
-        pv1 = HL7Segment("PV1", self.encoding)
-        
-        pv1.add_field("1", 1)
-        pv1.add_field(patient_class, 2)
-        
-        for i in range(3, 51):
-            pv1.add_field("", i)
-        
-        self.segments.append(pv1)
+        self._append_raw("PV1", PV1_TEMPLATE.format(
+            patient_class=self.encoding.escape(patient_class),
+        ))
     
     def add_orc_segment(
         self,
@@ -465,7 +526,6 @@ class HL7Builder:
         orc.add_field(order_control, 1)
         orc.add_field(placer_order_number, 2)
         orc.add_field(filler_order_number, 3)
-        orc.add_field("", 4)
         orc.add_field(order_status, 5)
         orc.add_field(response_flag, 6)
         
@@ -475,7 +535,7 @@ class HL7Builder:
         orc.add_field(parent_order, 8)
         orc.add_field(
             self._format_hl7_date(datetime_of_transaction) if datetime_of_transaction else 
-            self._format_hl7_date(datetime.now()), 
+            self._now_hl7,
             9
         )
         
@@ -487,13 +547,8 @@ class HL7Builder:
         
         if ordering_provider:
             orc.add_field(f"{ordering_provider.name}^{ordering_provider.id}", 12)
-        
-        orc.add_field("", 13)
-        orc.add_field("", 14)
-        orc.add_field("", 15)
-        orc.add_field("", 16)
-        
-        self.segments.append(orc)
+
+        self._append(orc)
     
     def add_rxe_segment(
         self,
@@ -519,57 +574,35 @@ class HL7Builder:
         
         rxe.add_field(self.encoding.component_separator.join(timing) if timing else "", 1)
         rxe.add_field(f"{medication.medication_code}^{medication.medication_name}^NDC", 2)
-        rxe.add_field(str(medication.quantity), 3)
-        rxe.add_field("", 4)
+        rxe.add_field(self._fmt_decimal(medication.quantity), 3)
         rxe.add_field(medication.unit, 5)
-        rxe.add_field(HL7_TABLES["medication_form"].get(medication.form, medication.form), 6)
+        rxe.add_field(MEDICATION_FORM_CACHE.get(medication.form, medication.form), 6)
         
         admin_instructions = medication.dosage_instruction
         if medication.special_instructions:
             admin_instructions += f"; {medication.special_instructions}"
         rxe.add_field(admin_instructions, 7)
-        
-        rxe.add_field("", 8)
+
         rxe.add_field("G" if medication.substitution_allowed else "N", 9)
-        rxe.add_field(str(medication.quantity), 10)
+        rxe.add_field(self._fmt_decimal(medication.quantity), 10)
         rxe.add_field(medication.unit, 11)
         rxe.add_field(str(medication.refills) if medication.refills else "0", 12)
-        rxe.add_field("", 13)
-        rxe.add_field("", 14)
-        rxe.add_field("", 15)
         rxe.add_field(str(medication.refills) if medication.refills else "0", 16)
         rxe.add_field("0", 17)
-        rxe.add_field("", 18)
-        rxe.add_field("", 19)
-        rxe.add_field("", 20)
-        rxe.add_field("", 21)
         rxe.add_field(give_per, 22)
         rxe.add_field(give_rate, 23)
         rxe.add_field(give_units, 24)
         rxe.add_field(give_strength, 25)
         rxe.add_field(give_strength_units, 26)
-        rxe.add_field("", 27)
-        rxe.add_field("", 28)
-        rxe.add_field("", 29)
-        rxe.add_field("", 30)
-        
-        self.segments.append(rxe)
+
+        self._append(rxe)
         self.add_rxr_segment(medication.route)
     
     def add_rxr_segment(self, route: str, site: Optional[str] = None) -> None:
-        rxr = HL7Segment("RXR", self.encoding)
-        
-        rxr.add_field(f"{route}^{HL7_TABLES['route'].get(route, route)}^HL70162", 1)
-        
-        if site:
-            rxr.add_field(site, 2)
-        
-        rxr.add_field("", 3)
-        rxr.add_field("", 4)
-        rxr.add_field("", 5)
-        rxr.add_field("", 6)
-        
-        self.segments.append(rxr)
+        self._append_raw("RXR", RXR_TEMPLATE.format(
+            route=ROUTE_FIELD_CACHE.get(route) or "{0}^{0}^HL70162".format(self.encoding.escape(route)),
+            site=self.encoding.escape(site) if site else "",
+        ))
     
     def add_rxd_segment(
         self,
@@ -585,115 +618,97 @@ class HL7Builder:
         rxd.add_field(f"{medication.medication_code}^{medication.medication_name}^NDC", 2)
         rxd.add_field(
             self._format_hl7_date(fill_datetime) if fill_datetime else 
-            self._format_hl7_date(datetime.now()), 
+            self._now_hl7,
             3
         )
-        rxd.add_field(str(quantity_dispensed if quantity_dispensed else medication.quantity), 4)
+        rxd.add_field(self._fmt_decimal(quantity_dispensed if quantity_dispensed else medication.quantity), 4)
         rxd.add_field(medication.unit, 5)
-        rxd.add_field(HL7_TABLES["medication_form"].get(medication.form, medication.form), 6)
-        rxd.add_field("", 7)
+        rxd.add_field(MEDICATION_FORM_CACHE.get(medication.form, medication.form), 6)
         rxd.add_field(str(medication.refills) if medication.refills else "0", 8)
-        rxd.add_field("", 9)
-        rxd.add_field("", 10)
         rxd.add_field("G" if medication.substitution_allowed else "N", 11)
-        rxd.add_field("", 12)
-        rxd.add_field("", 13)
-        rxd.add_field("", 14)
-        rxd.add_field("", 15)
         rxd.add_field(medication.strength, 16)
-        rxd.add_field("", 17)
-        rxd.add_field("", 18)
-        rxd.add_field("", 19)
-        rxd.add_field("", 20)
-        rxd.add_field("", 21)
-        rxd.add_field("", 22)
-        rxd.add_field("", 23)
-        rxd.add_field("", 24)
-        rxd.add_field("", 25)
-        rxd.add_field("", 26)
-        rxd.add_field("", 27)
-        rxd.add_field("", 28)
-        rxd.add_field("", 29)
-        rxd.add_field("", 30)
-        rxd.add_field("", 31)
-        rxd.add_field("", 32)
-        rxd.add_field("", 33)
-        rxd.add_field("", 34)
-        rxd.add_field("", 35)
-        rxd.add_field("", 36)
-        rxd.add_field("", 37)
-        rxd.add_field("", 38)
-        
-        self.segments.append(rxd)
+
+        self._append(rxd)
     
     def add_diagnosis_segments(self, diagnoses: List[Tuple[str, str]]) -> None:
+        esc = self.encoding.escape
         for idx, (code, description) in enumerate(diagnoses, 1):
-            dg1 = HL7Segment("DG1", self.encoding)
-            dg1.add_field(str(idx), 1)
-            dg1.add_field("I10", 2)
-            dg1.add_field(f"{code}^{description}^I10", 3)
-            dg1.add_field("", 4)
-            dg1.add_field(self._format_hl7_date(datetime.now()), 5)
-            dg1.add_field("W", 6)
-            dg1.add_field("", 7)
-            dg1.add_field("", 8)
-            dg1.add_field("", 9)
-            dg1.add_field("", 10)
-            dg1.add_field("", 11)
-            dg1.add_field("", 12)
-            dg1.add_field("", 13)
-            dg1.add_field("", 14)
-            dg1.add_field("", 15)
-            dg1.add_field("", 16)
-            dg1.add_field("", 17)
-            dg1.add_field("", 18)
-            dg1.add_field("", 19)
-            dg1.add_field("", 20)
-            dg1.add_field("", 21)
-            self.segments.append(dg1)
-    
+            self._append_raw("DG1", DG1_TEMPLATE.format(
+                set_id=idx,
+                code=esc(code),
+                description=esc(description),
+                ts=self._now_hl7,
+            ))
+
     def add_allergy_segments(self, allergies: List[str]) -> None:
+        esc = self.encoding.escape
         for idx, allergy in enumerate(allergies, 1):
-            al1 = HL7Segment("AL1", self.encoding)
-            al1.add_field(str(idx), 1)
-            al1.add_field("DA", 2)
-            al1.add_field(allergy, 3)
-            al1.add_field("", 4)
-            al1.add_field("", 5)
-            al1.add_field("", 6)
-            self.segments.append(al1)
-    
+            self._append_raw("AL1", AL1_TEMPLATE.format(
+                set_id=idx,
+                allergy=esc(allergy),
+            ))
+
     def add_nte_segment(self, comment: str, set_id: int = 1, source: str = "P") -> None:
-        nte = HL7Segment("NTE", self.encoding)
-        nte.add_field(str(set_id), 1)
-        nte.add_field(source, 2)
-        nte.add_field(comment, 3)
-        self.segments.append(nte)
+        esc = self.encoding.escape
+        self._append_raw("NTE", NTE_TEMPLATE.format(
+            set_id=set_id,
+            source=esc(source),
+            comment=esc(comment),
+        ))
     
     def build_message(self) -> str:
         if self.config.include_msh:
-            if not any(s.segment_id == "MSH" for s in self.segments):
+            if not self._segment_counts["MSH"]:
                 self.add_msh_segment()
-        
-        segments_str = [segment.build() for segment in self.segments]
-        return SEGMENT_DELIMITER.join(segments_str)
 
-def convert_edifact_to_hl7(edifact_data: Dict[str, Any]) -> Dict[str, Any]:
+        return SEGMENT_DELIMITER.join(self.segments)
+
+    def build_message_bytes(self) -> bytes:
+        return self.build_message().encode("utf-8")
+
+def _as_decimal(value: Union[str, int, float, Decimal]) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal.from_float(value)
+    return Decimal(value)
+
+def _build_medication(item: Dict[str, Any], _get=dict.get) -> MedicationItem:
+    form = item["form"]
+    return MedicationItem(
+        medication_code=item["medication_code"],
+        medication_name=item["medication_name"],
+        form=form,
+        strength=item["strength"],
+        quantity=_as_decimal(item["quantity"]),
+        unit=_get(item, "unit") or form,
+        dosage_instruction=item["dosage_instruction"],
+        route=item["route"],
+        duration_days=_get(item, "duration_days"),
+        refills=_get(item, "refills"),
+        special_instructions=_get(item, "special_instructions"),
+        substitution_allowed=_get(item, "substitution_allowed", True),
+        frequency="QD"
+    )
+
+def convert_edifact_to_hl7(edifact_data: Mapping[str, Any]) -> Dict[str, Any]:
+    patient_data = edifact_data["patient"]
+    weight_kg = patient_data.get("weight_kg")
+    height_cm = patient_data.get("height_cm")
+
     hl7_data = {
         "patient": PatientInfo(
-            patient_id=edifact_data["patient"]["patient_id"],
-            name=edifact_data["patient"]["name"],
+            patient_id=patient_data["patient_id"],
+            name=patient_data["name"],
             date_of_birth=datetime.strptime(
-                edifact_data["patient"]["date_of_birth"], 
+                patient_data["date_of_birth"],
                 "%Y%m%d"
             ).date(),
-            gender=edifact_data["patient"]["gender"],
-            weight_kg=Decimal(str(edifact_data["patient"].get("weight_kg", 0))) 
-                     if edifact_data["patient"].get("weight_kg") else None,
-            height_cm=Decimal(str(edifact_data["patient"].get("height_cm", 0))) 
-                     if edifact_data["patient"].get("height_cm") else None,
-            allergies=edifact_data["patient"].get("allergies", []),
-            diagnoses=[(d, "") for d in edifact_data["patient"].get("diagnoses", [])]
+            gender=patient_data["gender"],
+            weight_kg=_as_decimal(weight_kg) if weight_kg else None,
+            height_cm=_as_decimal(height_cm) if height_cm else None,
+            allergies=patient_data.get("allergies", []),
+            diagnoses=[(d, "") for d in patient_data.get("diagnoses", [])]
         ),
         "provider": PrescribingProvider(
             id=edifact_data["prescribing_doctor"]["id"],
@@ -709,24 +724,7 @@ def convert_edifact_to_hl7(edifact_data: Dict[str, Any]) -> Dict[str, Any]:
             address=edifact_data["pharmacy"].get("address"),
             contact=edifact_data["pharmacy"].get("contact")
         ),
-        "medications": [
-            MedicationItem(
-                medication_code=item["medication_code"],
-                medication_name=item["medication_name"],
-                form=item["form"],
-                strength=item["strength"],
-                quantity=Decimal(str(item["quantity"])),
-                unit=item.get("unit", item["form"]),
-                dosage_instruction=item["dosage_instruction"],
-                route=item["route"],
-                duration_days=item.get("duration_days"),
-                refills=item.get("refills"),
-                special_instructions=item.get("special_instructions"),
-                substitution_allowed=item.get("substitution_allowed", True),
-                frequency="QD"
-            )
-            for item in edifact_data["items"]
-        ],
+        "medications": [_build_medication(item) for item in edifact_data["items"]],
         "prescription_info": {
             "prescription_id": edifact_data["prescription_id"],
             "prescription_date": datetime.strptime(
@@ -744,10 +742,14 @@ def convert_edifact_to_hl7(edifact_data: Dict[str, Any]) -> Dict[str, Any]:
     
     return hl7_data
 
+class HL7Message(NamedTuple):
+    text: str
+    segments: List[str]
+
 def create_hl7_prescription(
     hl7_data: Dict[str, Any],
     config: Optional[HL7Config] = None
-) -> str:
+) -> HL7Message:
     if config is None:
         config = HL7Config()
     
@@ -780,10 +782,32 @@ def create_hl7_prescription(
     for idx, medication in enumerate(hl7_data["medications"], 1):
         builder.add_rxe_segment(medication)
         
-        if config.message_type == MessageType.RDE:
+        if builder._is_rde:
             builder.add_rxd_segment(medication, dispense_number=idx)
-    
-    return builder.build_message()
+
+    return HL7Message(text=builder.build_message(), segments=builder.segments)
+
+def _convert_and_build(edifact_data: Dict[str, Any], config: HL7Config) -> str:
+    return create_hl7_prescription(convert_edifact_to_hl7(edifact_data), config).text
+
+def batch_convert(
+    edifact_list: List[Dict[str, Any]],
+    config: Optional[HL7Config] = None,
+    workers: Optional[int] = None
+) -> List[str]:
+    if config is None:
+        config = HL7Config()
+
+    if workers == 1 or len(edifact_list) <= 1:
+        return [_convert_and_build(edifact, config) for edifact in edifact_list]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            _convert_and_build,
+            edifact_list,
+            repeat(config),
+            chunksize=64
+        ))
 
 def parse_hl7_response(hl7_message: str) -> Dict[str, Any]:
     lines = hl7_message.split(SEGMENT_DELIMITER)
@@ -795,10 +819,11 @@ def parse_hl7_response(hl7_message: str) -> Dict[str, Any]:
     
     for line in lines:
         if line.startswith("MSH"):
-            result["message_type"] = line.split("|")[8] if len(line.split("|")) > 8 else ""
-            result["message_control_id"] = line.split("|")[9] if len(line.split("|")) > 9 else ""
+            parts = line.split("|", 10)
+            result["message_type"] = parts[8] if len(parts) > 8 else ""
+            result["message_control_id"] = parts[9] if len(parts) > 9 else ""
         elif line.startswith("MSA"):
-            parts = line.split("|")
+            parts = line.split("|", 4)
             if len(parts) >= 2:
                 result["acknowledgment"] = {
                     "code": parts[1],
@@ -816,97 +841,96 @@ def parse_hl7_response(hl7_message: str) -> Dict[str, Any]:
     
     return result
 
+_SAMPLE_EDIFACT: Mapping[str, Any] = MappingProxyType({
+    "message_ref": "MED0001",
+    "prescription_id": "RX2025-0509-001",
+    "prescription_date": "20241210",
+    "urgent": False,
+    "validity_days": 30,
+    "payment_type": "INSURANCE",
+    "insurance_info": {
+        "id": "INS123456789",
+        "name": "HealthCare Plus"
+    },
+    "dispense_as_written": False,
+    "clinical_notes": "Patient has history of mild hypertension. Monitor blood pressure during treatment.",
+    "prescribing_doctor": {
+        "id": "DOC987654321",
+        "name": "Dr. Jane Smith",
+        "qualification": "MD",
+        "specialty": "Internal Medicine",
+        "contact": "+1-555-123-4567",
+        "address": "123 Medical Center, Suite 100"
+    },
+    "patient": {
+        "patient_id": "PAT123456789",
+        "name": "John Doe",
+        "date_of_birth": "19800515",
+        "gender": "M",
+        "weight_kg": "85.5",
+        "height_cm": "180.0",
+        "allergies": ["Penicillin", "Sulfa drugs"],
+        "diagnoses": ["I10", "E11.9"]
+    },
+    "pharmacy": {
+        "id": "PHARM12345",
+        "name": "City Pharmacy",
+        "address": "456 Main Street",
+        "contact": "+1-555-987-6543"
+    },
+    "items": [
+        {
+            "medication_code": "C09AA01",
+            "medication_name": "Lisinopril",
+            "form": "TAB",
+            "strength": "10 mg",
+            "quantity": "30",
+            "unit": "TAB",
+            "dosage_instruction": "Take 1 tablet once daily in the morning",
+            "route": "PO",
+            "duration_days": 30,
+            "refills": 3,
+            "special_instructions": "Take with food if stomach upset occurs",
+            "substitution_allowed": True
+        }
+    ]
+})
+
+_DEMO_CONFIG = HL7Config(
+    sending_application="EDIFACT_CONVERTER",
+    sending_facility="HOSPITAL_XYZ",
+    receiving_application="PHARMACY_SYSTEM",
+    receiving_facility="PHARMACY_ABC",
+    version="2.5",
+    message_type=MessageType.RDE,
+    processing_id="P"
+)
+
 def main():
-    edifact_prescription = {
-        "message_ref": "MED0001",
-        "prescription_id": "RX2025-0509-001",
-        "prescription_date": "20241210",
-        "urgent": False,
-        "validity_days": 30,
-        "payment_type": "INSURANCE",
-        "insurance_info": {
-            "id": "INS123456789",
-            "name": "HealthCare Plus"
-        },
-        "dispense_as_written": False,
-        "clinical_notes": "Patient has history of mild hypertension. Monitor blood pressure during treatment.",
-        "prescribing_doctor": {
-            "id": "DOC987654321",
-            "name": "Dr. Jane Smith",
-            "qualification": "MD",
-            "specialty": "Internal Medicine",
-            "contact": "+1-555-123-4567",
-            "address": "123 Medical Center, Suite 100"
-        },
-        "patient": {
-            "patient_id": "PAT123456789",
-            "name": "John Doe",
-            "date_of_birth": "19800515",
-            "gender": "M",
-            "weight_kg": "85.5",
-            "height_cm": "180.0",
-            "allergies": ["Penicillin", "Sulfa drugs"],
-            "diagnoses": ["I10", "E11.9"]
-        },
-        "pharmacy": {
-            "id": "PHARM12345",
-            "name": "City Pharmacy",
-            "address": "456 Main Street",
-            "contact": "+1-555-987-6543"
-        },
-        "items": [
-            {
-                "medication_code": "C09AA01",
-                "medication_name": "Lisinopril",
-                "form": "TAB",
-                "strength": "10 mg",
-                "quantity": "30",
-                "unit": "TAB",
-                "dosage_instruction": "Take 1 tablet once daily in the morning",
-                "route": "PO",
-                "duration_days": 30,
-                "refills": 3,
-                "special_instructions": "Take with food if stomach upset occurs",
-                "substitution_allowed": True
-            }
-        ]
-    }
-    
     try:
         logger.info("Converting EDIFACT to HL7 format...")
-        hl7_data = convert_edifact_to_hl7(edifact_prescription)
-        
-        config = HL7Config(
-            sending_application="EDIFACT_CONVERTER",
-            sending_facility="HOSPITAL_XYZ",
-            receiving_application="PHARMACY_SYSTEM",
-            receiving_facility="PHARMACY_ABC",
-            version="2.5",
-            message_type=MessageType.RDE,
-            processing_id="P"
-        )
-        
+        hl7_data = convert_edifact_to_hl7(_SAMPLE_EDIFACT)
+
         logger.info("Generating HL7 message...")
-        hl7_message = create_hl7_prescription(hl7_data, config)
+        hl7_message = create_hl7_prescription(hl7_data, _DEMO_CONFIG)
         
         print("\n" + "="*80)
         print("HL7 PRESCRIPTION MESSAGE (RDE^O11)")
         print("="*80)
-        print(hl7_message)
-        
-        with open("prescription.hl7", "w") as f:
-            f.write(hl7_message)
-        
-        logger.info(f"HL7 message saved to prescription.hl7")
-        
-        segments = hl7_message.split(SEGMENT_DELIMITER)
+        print(hl7_message.text)
+
+        segments = hl7_message.segments
+        with open("prescription.hl7", "wb") as f:
+            f.writelines(seg.encode("utf-8") + b"\r" for seg in segments)
+
+        logger.info("HL7 message saved to %s", "prescription.hl7")
+
         print(f"\nTotal segments: {len(segments)}")
-        print("Segment types:", ", ".join(sorted(set(s[:3] for s in segments if s))))
+        types_seen = {sys.intern(s[:3]) for s in segments if s}
+        print("Segment types:", ", ".join(sorted(types_seen)))
         
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("HL7 generation failed")
 
 if __name__ == "__main__":
     main()